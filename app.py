@@ -1,15 +1,47 @@
 # CLEAN VERSION 6.0 - No Duplicates
-from flask import Flask, render_template, request, jsonify, Response
+from flask import Flask, render_template, request, Response
+from flask.json.provider import JSONProvider
 import requests
-import json
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
+from datetime import date, timedelta
 from collections import defaultdict
+from operator import itemgetter
+import heapq
+from dataclasses import dataclass
 import io
+import csv
 import os
 import sys
 import logging
+import hashlib
+import hmac
+import re
+from functools import lru_cache
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import LRUCache, TTLCache
+from flask_compress import Compress
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Gzip JSON and CSV responses for clients that accept it
+app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/csv']
+app.config['COMPRESS_ALGORITHM'] = 'gzip'
+app.config['COMPRESS_LEVEL'] = 5
+Compress(app)
 
 # Configure logging
 logging.basicConfig(
@@ -19,105 +51,269 @@ logging.basicConfig(
 )
 app.logger.setLevel(logging.INFO)
 
+# Shared HTTP session so every outbound call reuses pooled keep-alive connections
+HTTP = requests.Session()
+HTTP.mount('https://', HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+))
+HTTP.headers.update({'Accept-Encoding': 'gzip, deflate', 'User-Agent': 'jason-pharma-leads/1.0'})
+
+def ojson(data, code=200):
+    """Serialize data to a JSON response using orjson"""
+    return Response(orjson.dumps(data), status=code, mimetype='application/json')
+
+def cached_ojson(data, max_age=300, stale_while_revalidate=60):
+    """Serialize data with Cache-Control and an ETag, answering 304 when unchanged"""
+    body = orjson.dumps(data)
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    headers = {
+        'Cache-Control': f'public, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}',
+        'ETag': f'"{etag}"'
+    }
+    
+    # Compress() suffixes the ETag of gzipped bodies, so accept either form and
+    # answer with the validator the client actually holds
+    for tag in (etag, f'{etag}:gzip'):
+        if request.if_none_match.contains(tag):
+            headers['ETag'] = f'"{tag}"'
+            headers['Vary'] = 'Accept-Encoding'
+            return Response(status=304, headers=headers)
+    return Response(body, mimetype='application/json', headers=headers)
+
+# Study fields consumed by the scorer and endpoints; everything else is left on the server
+REQUIRED_FIELDS = (
+    'protocolSection.identificationModule.nctId',
+    'protocolSection.identificationModule.briefTitle',
+    'protocolSection.statusModule.overallStatus',
+    'protocolSection.statusModule.startDateStruct.date',
+    'protocolSection.statusModule.completionDateStruct.date',
+    'protocolSection.designModule.phases',
+    'protocolSection.conditionsModule.conditions',
+    'protocolSection.armsInterventionsModule.interventions.name',
+    'protocolSection.sponsorCollaboratorsModule.leadSponsor.name',
+    'protocolSection.sponsorCollaboratorsModule.collaborators.name',
+)
+
 class ClinicalTrialsAPI:
     """Interface for ClinicalTrials.gov API v2.0"""
     
     BASE_URL = "https://clinicaltrials.gov/api/v2/studies"
     
+    # Phase 3 trials led by industry sponsors
+    LATE_PHASE_QUERY = 'AREA[Phase]PHASE3 AND AREA[LeadSponsorClass]INDUSTRY'
+    
+    # Only request the study fields we actually read
+    FIELDS = ','.join(REQUIRED_FIELDS)
+    
     def __init__(self):
-        self.session = requests.Session()
+        self.session = HTTP
     
-    def get_late_phase_trials(self):
+    def get_late_phase_trials(self, page_token=None, page_size=80, refresh=False, ttl=None):
         """Get trials in late phases using API v2.0"""
         params = {
-            'query.term': 'AREA[Phase]PHASE3',
-            'pageSize': 200,
-            'format': 'json'
+            'query.term': self.LATE_PHASE_QUERY,
+            'pageSize': page_size
         }
+        if page_token:
+            params['pageToken'] = page_token
         
+        return self.search_trials(params, refresh, ttl)
+    
+    def search_trials(self, params, refresh=False, ttl=None):
+        """Search studies, serving repeat queries from the response cache"""
+        params = {'fields': self.FIELDS, **params}
         try:
-            response = self.session.get(self.BASE_URL, params=params, timeout=30)
-            app.logger.info(f"API call: {response.url}")
-            app.logger.info(f"Status code: {response.status_code}")
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                app.logger.error(f"API error: {response.status_code}")
-                return None
+            return _cached_fetch(self.BASE_URL, params, refresh, ttl or CACHE_TTL['default'])
         except Exception as e:
-            app.logger.error(f"API request failed: {e}")
+            app.logger.error("API request failed: %s", e)
             return None
 
+# Scoring weights by trial phase and overall status
+PHASE_SCORE = {'PHASE4': 50, 'PHASE3': 40, 'PHASE2': 20}
+STATUS_SCORE = {'COMPLETED': 30, 'ACTIVE_NOT_RECRUITING': 25, 'RECRUITING': 15}
+
+# Sponsor names that indicate an academic or public, non-commercial organisation
+_NON_COMMERCIAL = re.compile(r'\b(University|Hospital|Medical Cent(?:er|re)|Institute|Clinic|Foundation|College|NIH|NCI)\b', re.I)
+
+# Shared read-only default for missing API modules and fields
+EMPTY = {}
+
+@dataclass(slots=True)
+class StudySummary:
+    """The fields the app reads from a v2 study record"""
+    nct_id: str
+    title: str
+    status: str
+    start_date: str
+    completion_date: str
+    phases: tuple
+    conditions: tuple
+    interventions: tuple
+    sponsors: tuple
+    
+    @property
+    def phase(self):
+        return ', '.join(self.phases) if self.phases else 'Unknown'
+    
+    @property
+    def condition(self):
+        return ', '.join(self.conditions) if self.conditions else 'Unknown'
+    
+    @property
+    def drug_name(self):
+        return ', '.join(self.interventions) if self.interventions else 'Unknown'
+
+def _summarize(study):
+    """Walk a study's protocolSection once and return a StudySummary"""
+    ps = study.get('protocolSection') or EMPTY
+    identification = ps.get('identificationModule') or EMPTY
+    status_module = ps.get('statusModule') or EMPTY
+    sponsor_module = ps.get('sponsorCollaboratorsModule') or EMPTY
+    
+    # Lead sponsor first, then collaborators
+    sponsors = (
+        sponsor_module.get('leadSponsor', EMPTY).get('name', ''),
+        *(collab.get('name', '') for collab in sponsor_module.get('collaborators', ())),
+    )
+    
+    return StudySummary(
+        nct_id=identification.get('nctId', 'Unknown'),
+        title=identification.get('briefTitle', 'Unknown'),
+        status=status_module.get('overallStatus', 'Unknown'),
+        start_date=status_module.get('startDateStruct', EMPTY).get('date', ''),
+        completion_date=status_module.get('completionDateStruct', EMPTY).get('date', ''),
+        phases=tuple((ps.get('designModule') or EMPTY).get('phases', ())),
+        conditions=tuple((ps.get('conditionsModule') or EMPTY).get('conditions', ())),
+        interventions=tuple(interv.get('name', '') for interv in (ps.get('armsInterventionsModule') or EMPTY).get('interventions', ())),
+        sponsors=sponsors,
+    )
+
+def _parse_date(date_str):
+    """Parse an API date ('YYYY-MM-DD' or 'YYYY-MM'), returning None if invalid"""
+    if len(date_str) == 7:
+        date_str += '-01'
+    elif len(date_str) != 10:
+        return None
+    try:
+        return date.fromisoformat(date_str)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=1024)
+def _score(phases, status, date_str, today):
+    """Score a trial from its phases, status and completion date, memoized per day"""
+    # Phase and status scores
+    score = max((PHASE_SCORE[p] for p in phases if p in PHASE_SCORE), default=0)
+    score += STATUS_SCORE.get(status, 0)
+    
+    # Timeline scoring
+    comp_date = _parse_date(date_str)
+    if comp_date:
+        days_to_completion = (comp_date - today).days
+        if days_to_completion <= 180:
+            score += 35
+        elif days_to_completion <= 365:
+            score += 25
+    
+    return min(score, 100)
+
 class LeadScorer:
     """Score and rank potential leads"""
     
     @staticmethod
-    def calculate_fda_approval_likelihood(trial_data):
+    def calculate_fda_approval_likelihood(trial_data, today=None, summary=None):
         """Calculate likelihood of FDA approval"""
-        score = 0
-        
-        # Get phase
-        phases = trial_data.get('protocolSection', {}).get('designModule', {}).get('phases', [])
-        phase_str = ', '.join(phases) if phases else ''
-        
-        if 'PHASE3' in phase_str:
-            score += 40
-        elif 'PHASE2' in phase_str:
-            score += 20
-        elif 'PHASE4' in phase_str:
-            score += 50
-        
-        # Get status
-        status = trial_data.get('protocolSection', {}).get('statusModule', {}).get('overallStatus', '')
-        if status == 'COMPLETED':
-            score += 30
-        elif status == 'ACTIVE_NOT_RECRUITING':
-            score += 25
-        elif status == 'RECRUITING':
-            score += 15
-        
-        # Timeline scoring
-        completion_date_info = trial_data.get('protocolSection', {}).get('statusModule', {}).get('completionDateStruct', {})
-        if completion_date_info:
-            try:
-                date_str = completion_date_info.get('date', '')
-                if date_str:
-                    comp_date = datetime.strptime(date_str, '%Y-%m-%d')
-                    days_to_completion = (comp_date - datetime.now()).days
-                    if days_to_completion <= 180:
-                        score += 35
-                    elif days_to_completion <= 365:
-                        score += 25
-            except:
-                pass
-        
-        return min(score, 100)
+        if today is None:
+            today = date.today()
+        summary = summary or _summarize(trial_data)
+        return _score(summary.phases, summary.status, summary.completion_date, today)
     
     @staticmethod
-    def extract_company_info(trial_data):
+    def extract_company_info(trial_data, summary=None):
         """Extract company information"""
-        companies = []
-        
-        # Get lead sponsor
-        lead_sponsor = trial_data.get('protocolSection', {}).get('sponsorCollaboratorsModule', {}).get('leadSponsor', {})
-        if lead_sponsor:
-            sponsor_name = lead_sponsor.get('name', '')
-            if sponsor_name and 'University' not in sponsor_name and 'Hospital' not in sponsor_name:
-                companies.append(sponsor_name)
+        summary = summary or _summarize(trial_data)
         
-        # Get collaborators
-        collaborators = trial_data.get('protocolSection', {}).get('sponsorCollaboratorsModule', {}).get('collaborators', [])
-        for collab in collaborators:
-            collab_name = collab.get('name', '')
-            if collab_name and 'University' not in collab_name and 'Hospital' not in collab_name:
-                companies.append(collab_name)
+        # Queries already restrict lead sponsors to industry, and names such as
+        # 'Serum Institute of India' would trip the regex, so only screen collaborators
+        lead_sponsor, collaborators = summary.sponsors[0], summary.sponsors[1:]
+        companies = [lead_sponsor] if lead_sponsor else []
+        companies.extend(name for name in collaborators if name and not _NON_COMMERCIAL.search(name))
         
-        return list(set(companies))
+        # dict.fromkeys dedupes while keeping first-seen order, lead sponsor first
+        return list(dict.fromkeys(companies))
 
 # Initialize API client
 ct_api = ClinicalTrialsAPI()
 
+# Seconds an upstream response stays fresh, per endpoint
+CACHE_TTL = {'leads': 30, 'company': 300, 'pipeline': 600, 'default': 300}
+
+# How long past its TTL a response may still be served while it is refetched
+CACHE_STALE_GRACE = 3600
+
+# Parsed upstream responses as (fetched_at, data), keyed by URL and query params
+_api_cache = LRUCache(maxsize=128)
+_api_cache_lock = threading.Lock()
+
+# Cache keys with a background refresh in flight
+_refreshing = set()
+
+def _refresh_in_background(key, url, params, ttl):
+    """Refetch a stale cache entry on a daemon thread, once per key at a time"""
+    with _api_cache_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    
+    def run():
+        try:
+            _cached_fetch(url, params, refresh=True, ttl=ttl)
+        except Exception as e:
+            app.logger.error("Background refresh failed: %s", e)
+        finally:
+            with _api_cache_lock:
+                _refreshing.discard(key)
+    
+    threading.Thread(target=run, name='cache-refresh', daemon=True).start()
+
+def _cached_fetch(url, params, refresh=False, ttl=CACHE_TTL['default']):
+    """Fetch and parse an API response, reusing it while fresh and serving it stale while refetching"""
+    key = (url, tuple(sorted(params.items())))
+    with _api_cache_lock:
+        cached = _api_cache.get(key)
+    
+    now = time.monotonic()
+    if cached is not None and not refresh and now - cached[0] < ttl:
+        return cached[1]
+    
+    # Within the grace period the last good response is served without waiting on
+    # the upstream (and its retries); the refetch happens off the request thread
+    stale = cached[1] if cached is not None and now - cached[0] < ttl + CACHE_STALE_GRACE else None
+    if stale is not None and not refresh:
+        _refresh_in_background(key, url, params, ttl)
+        return stale
+    
+    try:
+        response = HTTP.get(url, params=params, timeout=30)
+    except requests.RequestException as e:
+        if stale is None:
+            raise
+        app.logger.error("API request failed, serving stale response: %s", e)
+        return stale
+    
+    app.logger.debug("API call: %s -> %d", response.url, response.status_code)
+    
+    if response.status_code != 200:
+        app.logger.error("API error: %d", response.status_code)
+        return stale
+    
+    trials_data = orjson.loads(response.content)
+    with _api_cache_lock:
+        _api_cache[key] = (time.monotonic(), trials_data)
+    return trials_data
+
 @app.route('/')
 def index():
     """Main dashboard"""
@@ -127,48 +323,51 @@ def index():
 def debug_api():
     """Debug endpoint"""
     try:
-        test_url = "https://clinicaltrials.gov/api/v2/studies"
         test_params = {
             'query.term': 'AREA[Phase]PHASE3',
-            'pageSize': 2,
-            'format': 'json'
+            'pageSize': 2
         }
         
-        response = requests.get(test_url, params=test_params, timeout=30)
-        
-        # Get sample leads
-        leads_response = get_leads()
-        
-        fields_info = {}
-        if leads_response.status_code == 200:
+        # Run the API test and the sample leads fetch concurrently
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            api_future = executor.submit(ct_api.session.get, ct_api.BASE_URL, params=test_params, timeout=30)
+            leads_future = executor.submit(_compute_leads)
+            response = api_future.result()
+            
+            # Get sample leads
+            leads_status = 200
+            fields_info = {}
             try:
-                sample_leads = json.loads(leads_response.data)
-                if sample_leads:
-                    first_lead = sample_leads[0]
-                    fields_info = {
-                        'total_leads': len(sample_leads),
-                        'fields_in_first_lead': list(first_lead.keys()),
-                        'sample_values': {k: str(v)[:100] for k, v in first_lead.items()}
-                    }
-            except Exception as parse_error:
-                fields_info = {'parse_error': str(parse_error)}
+                sample_leads = leads_future.result()
+            except Exception as leads_error:
+                sample_leads = None
+                leads_status = 500
+                fields_info = {'error': str(leads_error)}
+        
+        if sample_leads:
+            first_lead = sample_leads[0]
+            fields_info = {
+                'total_leads': len(sample_leads),
+                'fields_in_first_lead': list(first_lead.keys()),
+                'sample_values': {k: str(v)[:100] for k, v in first_lead.items()}
+            }
         
-        return jsonify({
+        return ojson({
             'api_test': {
                 'status_code': response.status_code,
                 'url': response.url,
                 'working': response.status_code == 200,
-                'first_100_chars': response.text[:100] if response.text else 'No response'
+                'first_100_chars': response.content[:100].decode('utf-8', 'replace') if response.content else 'No response'
             },
             'leads_test': {
-                'status_code': leads_response.status_code,
-                'working': leads_response.status_code == 200,
+                'status_code': leads_status,
+                'working': leads_status == 200,
                 'data_info': fields_info
             }
         })
         
     except Exception as e:
-        return jsonify({
+        return ojson({
             'error': str(e),
             'error_type': type(e).__name__
         })
@@ -177,7 +376,7 @@ def debug_api():
 def export_leads_test():
     """Test export function"""
     try:
-        app.logger.info("TEST EXPORT: Starting...")
+        app.logger.debug("TEST EXPORT: Starting...")
         
         csv_content = "NCT ID,Company,Drug,Priority\n"
         csv_content += "NCT12345,Test Company,Test Drug,High\n"
@@ -192,169 +391,176 @@ def export_leads_test():
         )
         
     except Exception as e:
-        app.logger.error(f"TEST EXPORT ERROR: {e}")
-        return jsonify({'error': f'Test export error: {str(e)}'}), 500
+        app.logger.error("TEST EXPORT ERROR: %s", e)
+        return ojson({'error': f'Test export error: {str(e)}'}, 500)
 
-@app.route('/api/leads')
-def get_leads():
-    """Get scored leads from clinical trials data"""
-    app.logger.info("Starting get_leads function...")
+@app.route('/api/cache/clear', methods=['POST'])
+def clear_cache():
+    """Drop this worker's cached upstream responses and trial scores (admin only)"""
+    # Disabled unless a shared secret is configured; callers send it as X-Admin-Token
+    token = os.environ.get('CACHE_CLEAR_TOKEN')
+    if not token:
+        return ojson({'error': 'Not found'}, 404)
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+        return ojson({'error': 'Forbidden'}, 403)
     
-    try:
-        # Get late phase trials
-        trials_data = ct_api.get_late_phase_trials()
+    with _api_cache_lock:
+        cleared = len(_api_cache)
+        _api_cache.clear()
+    with _leads_cache_lock:
+        _leads_cache.clear()
+    _score.cache_clear()
+    app.logger.info("Cleared %d cached API responses", cleared)
+    return ojson({'cleared': cleared})
+
+# Lead list size and how many upstream pages to scan for it
+MAX_LEADS = 50
+LEAD_PAGE_SIZE = 80
+MAX_LEAD_PAGES = 3
+
+def _iter_late_phase_pages(refresh=False):
+    """Yield pages of late phase studies, fetching each only when asked for"""
+    page_token = None
+    for page in range(MAX_LEAD_PAGES):
+        trials_data = ct_api.get_late_phase_trials(page_token, LEAD_PAGE_SIZE, refresh, CACHE_TTL['leads'])
         
         if not trials_data:
-            app.logger.error("No trials_data received")
-            return jsonify({'error': 'No response from ClinicalTrials.gov API'}), 500
+            if page == 0:
+                app.logger.error("No trials_data received")
+                raise RuntimeError('No response from ClinicalTrials.gov API')
+            return
         
         # New API v2.0 structure
         studies = trials_data.get('studies', [])
-        app.logger.info(f"Found {len(studies)} studies")
+        app.logger.debug("Found %d studies", len(studies))
         
-        if not studies:
-            return jsonify({'error': 'No studies found'}), 500
+        if not studies and page == 0:
+            raise RuntimeError('No studies found')
         
-        leads = []
+        yield studies
+        
+        page_token = trials_data.get('nextPageToken')
+        if not page_token:
+            return
+
+def _iter_lead_candidates(today, refresh=False):
+    """Yield (likelihood, lead) pairs for qualifying studies"""
+    found = 0
+    for studies in _iter_late_phase_pages(refresh):
         for i, study in enumerate(studies):
             try:
+                # Walk the study once and share the summary with the scorer
+                summary = _summarize(study)
+                
                 # Calculate FDA approval likelihood
-                likelihood = LeadScorer.calculate_fda_approval_likelihood(study)
+                likelihood = LeadScorer.calculate_fda_approval_likelihood(study, today, summary)
                 
                 # Extract company info
-                companies = LeadScorer.extract_company_info(study)
+                companies = LeadScorer.extract_company_info(study, summary)
                 
                 if companies and likelihood > 30:
-                    # Extract data from new API structure
-                    protocol_section = study.get('protocolSection', {})
-                    identification = protocol_section.get('identificationModule', {})
-                    status_module = protocol_section.get('statusModule', {})
-                    design_module = protocol_section.get('designModule', {})
-                    conditions_module = protocol_section.get('conditionsModule', {})
-                    interventions_module = protocol_section.get('armsInterventionsModule', {})
-                    
-                    # Get intervention names
-                    interventions = interventions_module.get('interventions', [])
-                    intervention_names = [interv.get('name', '') for interv in interventions]
-                    drug_name = ', '.join(intervention_names) if intervention_names else 'Unknown'
-                    
-                    # Get conditions
-                    conditions = conditions_module.get('conditions', [])
-                    condition = ', '.join(conditions) if conditions else 'Unknown'
-                    
-                    # Get completion date
-                    completion_date_struct = status_module.get('completionDateStruct', {})
-                    completion_date = completion_date_struct.get('date', 'TBD')
-                    
-                    # Get phases
-                    phases = design_module.get('phases', [])
-                    phase = ', '.join(phases) if phases else 'Unknown'
-                    
                     lead = {
-                        'nct_id': identification.get('nctId', 'Unknown'),
-                        'title': identification.get('briefTitle', 'Unknown'),
-                        'phase': phase,
-                        'status': status_module.get('overallStatus', 'Unknown'),
+                        'nct_id': summary.nct_id,
+                        'title': summary.title,
+                        'phase': summary.phase,
+                        'status': summary.status,
                         'companies': companies,
-                        'drug_name': drug_name,
-                        'condition': condition,
-                        'completion_date': completion_date,
+                        'drug_name': summary.drug_name,
+                        'condition': summary.condition,
+                        'completion_date': summary.completion_date or 'TBD',
                         'fda_likelihood': likelihood,
                         'priority': 'High' if likelihood > 70 else 'Medium' if likelihood > 50 else 'Low'
                     }
-                    leads.append(lead)
-                    
-                if len(leads) >= 50:
-                    break
-                        
+                    found += 1
+                    yield likelihood, lead
+                
             except Exception as trial_error:
-                app.logger.error(f"Error processing study {i}: {trial_error}")
+                app.logger.error("Error processing study %d: %s", i, trial_error)
                 continue
         
-        app.logger.info(f"Generated {len(leads)} leads")
-        
-        # Sort by FDA likelihood
-        leads.sort(key=lambda x: x['fda_likelihood'], reverse=True)
-        
-        return jsonify(leads)
+        # Only page further while the candidate pool is short
+        if found >= MAX_LEADS:
+            return
+
+# Scored lead list shared by /api/leads and /api/export, keyed by day
+_leads_cache = TTLCache(maxsize=1, ttl=CACHE_TTL['leads'])
+_leads_cache_lock = threading.Lock()
+
+def _compute_leads(refresh=False):
+    """Score late phase trials and return the top leads"""
+    today = date.today()
+    if not refresh:
+        with _leads_cache_lock:
+            leads = _leads_cache.get(today)
+        if leads is not None:
+            return leads
+    
+    # Keep the best MAX_LEADS by FDA likelihood without sorting every candidate
+    candidates = _iter_lead_candidates(today, refresh)
+    leads = [lead for _, lead in heapq.nlargest(MAX_LEADS, candidates, key=itemgetter(0))]
+    
+    app.logger.info("Generated %d leads", len(leads))
+    
+    with _leads_cache_lock:
+        _leads_cache[today] = leads
+    return leads
+
+@app.route('/api/leads')
+def get_leads():
+    """Get scored leads from clinical trials data"""
+    app.logger.debug("Starting get_leads function...")
+    
+    try:
+        return cached_ojson(_compute_leads(), max_age=CACHE_TTL['leads'])
     
     except Exception as e:
-        app.logger.error(f"Error in get_leads: {e}")
+        app.logger.error("Error in get_leads: %s", e)
         import traceback
-        app.logger.error(f"Full traceback: {traceback.format_exc()}")
-        return jsonify({'error': str(e), 'error_type': type(e).__name__}), 500
+        app.logger.error("Full traceback: %s", traceback.format_exc())
+        return ojson({'error': str(e), 'error_type': type(e).__name__}, 500)
 
 @app.route('/api/export')
 def export_leads():
     """Export leads - Proper CSV format for Excel"""
-    app.logger.info("CSV EXPORT: Starting...")
+    app.logger.debug("CSV EXPORT: Starting...")
     
     try:
         # Get leads data
-        leads_response = get_leads()
-        
-        if leads_response.status_code != 200:
-            return jsonify({'error': 'Could not fetch leads'}), 500
-            
-        leads_data = json.loads(leads_response.data)
+        leads_data = _compute_leads()
         
         if not leads_data:
-            return jsonify({'error': 'No leads found'}), 400
-        
-        # Build proper CSV with commas and quoted fields
-        lines = []
-        
-        # Header row with proper CSV formatting
-        headers = ["NCT ID", "Title", "Drug Name", "Companies", "Phase", "Status", "Condition", "Completion Date", "FDA Likelihood %", "Priority"]
-        lines.append(','.join(f'"{header}"' for header in headers))
-        
-        # Data rows
-        for lead in leads_data:
-            # Extract and clean data
-            nct_id = str(lead.get('nct_id', ''))
-            title = str(lead.get('title', ''))
-            drug_name = str(lead.get('drug_name', ''))
-            
-            # Handle companies list - convert to string
-            companies = lead.get('companies', [])
-            if isinstance(companies, list):
-                companies_str = ', '.join(companies)
-            else:
-                companies_str = str(companies)
-            
-            phase = str(lead.get('phase', ''))
-            status = str(lead.get('status', ''))
-            condition = str(lead.get('condition', ''))
-            completion_date = str(lead.get('completion_date', ''))
-            fda_likelihood = str(lead.get('fda_likelihood', ''))
-            priority = str(lead.get('priority', ''))
-            
-            # Create CSV row with proper quoting
-            row_data = [nct_id, title, drug_name, companies_str, phase, status, condition, completion_date, fda_likelihood, priority]
-            
-            # Quote each field and escape internal quotes
-            quoted_row = []
-            for field in row_data:
-                # Escape quotes by doubling them
-                escaped_field = field.replace('"', '""')
-                quoted_row.append(f'"{escaped_field}"')
-            
-            lines.append(','.join(quoted_row))
-        
-        # Join all lines
-        csv_content = '\n'.join(lines)
-        
-        app.logger.info(f"CSV EXPORT: Generated {len(csv_content)} characters")
+            return ojson({'error': 'No leads found'}, 400)
+        
+        # Quote every field so Excel keeps commas inside titles and company lists
+        output = io.StringIO()
+        writer = csv.writer(output, quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(["NCT ID", "Title", "Drug Name", "Companies", "Phase", "Status", "Condition", "Completion Date", "FDA Likelihood %", "Priority"])
+        
+        # At most MAX_LEADS rows, so a buffered body that Compress() can gzip
+        writer.writerows([
+            lead.get('nct_id', ''),
+            lead.get('title', ''),
+            lead.get('drug_name', ''),
+            ', '.join(lead.get('companies', [])),
+            lead.get('phase', ''),
+            lead.get('status', ''),
+            lead.get('condition', ''),
+            lead.get('completion_date', ''),
+            lead.get('fda_likelihood', ''),
+            lead.get('priority', '')
+        ] for lead in leads_data)
+        
+        app.logger.info("CSV EXPORT: Generated %d rows", len(leads_data))
         
         return Response(
-            csv_content,
+            output.getvalue(),
             mimetype='text/csv',
             headers={'Content-Disposition': 'attachment; filename=pharma_leads.csv'}
         )
         
     except Exception as e:
-        app.logger.error(f"CSV EXPORT ERROR: {e}")
-        return jsonify({'error': str(e)}), 500
+        app.logger.error("CSV EXPORT ERROR: %s", e)
+        return ojson({'error': str(e)}, 500)
 
 @app.route('/api/company/<company_name>')
 def get_company_details(company_name):
@@ -362,148 +568,149 @@ def get_company_details(company_name):
     try:
         params = {
             'query.term': f'AREA[LeadSponsorName]{company_name}',
-            'pageSize': 50,
-            'format': 'json'
+            'pageSize': 50
         }
         
-        response = requests.get("https://clinicaltrials.gov/api/v2/studies", params=params, timeout=30)
+        trials_data = ct_api.search_trials(params, ttl=CACHE_TTL['company'])
         
-        if response.status_code != 200:
-            return jsonify({'error': 'API request failed'}), 500
+        if trials_data is None:
+            return ojson({'error': 'API request failed'}, 500)
         
-        trials_data = response.json()
         studies = trials_data.get('studies', [])
         
         if not studies:
-            return jsonify({'error': 'No data available'}), 404
+            return ojson({'error': 'No data available'}, 404)
         
+        today = date.today()
         company_trials = []
         for study in studies:
             try:
-                protocol_section = study.get('protocolSection', {})
-                identification = protocol_section.get('identificationModule', {})
-                status_module = protocol_section.get('statusModule', {})
-                design_module = protocol_section.get('designModule', {})
-                conditions_module = protocol_section.get('conditionsModule', {})
-                interventions_module = protocol_section.get('armsInterventionsModule', {})
-                
-                interventions = interventions_module.get('interventions', [])
-                intervention_names = [interv.get('name', '') for interv in interventions]
-                drug_name = ', '.join(intervention_names) if intervention_names else 'Unknown'
-                
-                conditions = conditions_module.get('conditions', [])
-                condition = ', '.join(conditions) if conditions else 'Unknown'
-                
-                phases = design_module.get('phases', [])
-                phase = ', '.join(phases) if phases else 'Unknown'
-                
-                start_date_struct = status_module.get('startDateStruct', {})
-                start_date = start_date_struct.get('date', 'Unknown')
-                
-                completion_date_struct = status_module.get('completionDateStruct', {})
-                completion_date = completion_date_struct.get('date', 'Unknown')
-                
+                summary = _summarize(study)
                 trial_info = {
-                    'nct_id': identification.get('nctId', 'Unknown'),
-                    'title': identification.get('briefTitle', 'Unknown'),
-                    'phase': phase,
-                    'status': status_module.get('overallStatus', 'Unknown'),
-                    'drug_name': drug_name,
-                    'condition': condition,
-                    'start_date': start_date,
-                    'completion_date': completion_date,
-                    'fda_likelihood': LeadScorer.calculate_fda_approval_likelihood(study)
+                    'nct_id': summary.nct_id,
+                    'title': summary.title,
+                    'phase': summary.phase,
+                    'status': summary.status,
+                    'drug_name': summary.drug_name,
+                    'condition': summary.condition,
+                    'start_date': summary.start_date or 'Unknown',
+                    'completion_date': summary.completion_date or 'Unknown',
+                    'fda_likelihood': LeadScorer.calculate_fda_approval_likelihood(study, today, summary)
                 }
                 company_trials.append(trial_info)
                 
             except Exception as trial_error:
-                app.logger.error(f"Error processing trial: {trial_error}")
+                app.logger.error("Error processing trial: %s", trial_error)
                 continue
         
-        return jsonify({
+        return cached_ojson({
             'company': company_name,
             'total_trials': len(company_trials),
             'trials': company_trials
-        })
+        }, max_age=CACHE_TTL['company'])
     
     except Exception as e:
-        app.logger.error(f"Error in get_company_details: {e}")
-        return jsonify({'error': str(e)}), 500
+        app.logger.error("Error in get_company_details: %s", e)
+        return ojson({'error': str(e)}, 500)
+
+def _compute_pipeline(refresh=False):
+    """Return industry trials completing within the next 6 months"""
+    # 6 month horizon, computed once per batch
+    today = date.today()
+    horizon = today + timedelta(days=180)
+    
+    # Let the API drop trials completing after the horizon
+    params = {
+        'query.term': f'{ClinicalTrialsAPI.LATE_PHASE_QUERY} AND AREA[CompletionDate]RANGE[MIN,{horizon.isoformat()}]',
+        'pageSize': 100
+    }
+    
+    trials_data = ct_api.search_trials(params, refresh, CACHE_TTL['pipeline'])
+    
+    if trials_data is None:
+        raise RuntimeError('API request failed')
+    
+    studies = trials_data.get('studies', [])
+    
+    pipeline = []
+    for study in studies:
+        try:
+            summary = _summarize(study)
+            
+            # Cheapest rejection first: no commercial sponsor
+            companies = LeadScorer.extract_company_info(study, summary)
+            if not companies:
+                continue
+            
+            # Only trials completing within 6 months (partial dates pass the API range)
+            comp_date = _parse_date(summary.completion_date)
+            if not comp_date or comp_date > horizon:
+                continue
+            
+            # Score once the study has passed every filter
+            likelihood = LeadScorer.calculate_fda_approval_likelihood(study, today, summary)
+            
+            pipeline_item = {
+                'companies': companies,
+                'drug_name': summary.drug_name,
+                'phase': summary.phase,
+                'completion_date': summary.completion_date,
+                'condition': summary.condition,
+                'urgency': 'High',
+                'fda_likelihood': likelihood
+            }
+            pipeline.append(pipeline_item)
+            
+        except Exception as study_error:
+            app.logger.error("Error processing pipeline study: %s", study_error)
+            continue
+    
+    return pipeline
 
 @app.route('/api/pipeline')
 def get_pipeline_analysis():
     """Get pipeline analysis"""
     try:
-        params = {
-            'query.term': 'AREA[Phase]PHASE3',
-            'pageSize': 100,
-            'format': 'json'
-        }
-        
-        response = requests.get("https://clinicaltrials.gov/api/v2/studies", params=params, timeout=30)
-        
-        if response.status_code != 200:
-            return jsonify({'error': 'API request failed'}), 500
-        
-        trials_data = response.json()
-        studies = trials_data.get('studies', [])
-        
-        pipeline = []
-        for study in studies:
-            try:
-                protocol_section = study.get('protocolSection', {})
-                status_module = protocol_section.get('statusModule', {})
-                
-                completion_date_struct = status_module.get('completionDateStruct', {})
-                completion_date = completion_date_struct.get('date', '')
-                
-                within_6_months = False
-                if completion_date:
-                    try:
-                        comp_date = datetime.strptime(completion_date, '%Y-%m-%d')
-                        days_to_completion = (comp_date - datetime.now()).days
-                        within_6_months = days_to_completion <= 180
-                    except:
-                        pass
-                
-                if within_6_months:
-                    companies = LeadScorer.extract_company_info(study)
-                    if companies:
-                        identification = protocol_section.get('identificationModule', {})
-                        design_module = protocol_section.get('designModule', {})
-                        conditions_module = protocol_section.get('conditionsModule', {})
-                        interventions_module = protocol_section.get('armsInterventionsModule', {})
-                        
-                        interventions = interventions_module.get('interventions', [])
-                        intervention_names = [interv.get('name', '') for interv in interventions]
-                        drug_name = ', '.join(intervention_names) if intervention_names else 'Unknown'
-                        
-                        conditions = conditions_module.get('conditions', [])
-                        condition = ', '.join(conditions) if conditions else 'Unknown'
-                        
-                        phases = design_module.get('phases', [])
-                        phase = ', '.join(phases) if phases else 'Unknown'
-                        
-                        pipeline_item = {
-                            'companies': companies,
-                            'drug_name': drug_name,
-                            'phase': phase,
-                            'completion_date': completion_date,
-                            'condition': condition,
-                            'urgency': 'High',
-                            'fda_likelihood': LeadScorer.calculate_fda_approval_likelihood(study)
-                        }
-                        pipeline.append(pipeline_item)
-                        
-            except Exception as study_error:
-                app.logger.error(f"Error processing pipeline study: {study_error}")
-                continue
-        
-        return jsonify(pipeline)
+        return cached_ojson(_compute_pipeline(), max_age=CACHE_TTL['pipeline'])
     
     except Exception as e:
-        app.logger.error(f"Error in get_pipeline_analysis: {e}")
-        return jsonify({'error': str(e)}), 500
+        app.logger.error("Error in get_pipeline_analysis: %s", e)
+        return ojson({'error': str(e)}, 500)
+
+# Refresh each dataset shortly before its cached upstream responses expire
+CACHE_WARM_JOBS = (
+    (_compute_leads, CACHE_TTL['leads'] - 5),
+    (_compute_pipeline, CACHE_TTL['pipeline'] - 60),
+)
+_warmer_started = False
+
+def _warm_caches():
+    """Keep the leads and pipeline data warm so requests never wait on a cold fetch"""
+    next_run = {compute: 0.0 for compute, _ in CACHE_WARM_JOBS}
+    while True:
+        for compute, interval in CACHE_WARM_JOBS:
+            if time.monotonic() < next_run[compute]:
+                continue
+            next_run[compute] = time.monotonic() + interval
+            try:
+                compute(refresh=True)
+            except Exception as e:
+                app.logger.error("Cache warm-up failed in %s: %s", compute.__name__, e)
+        time.sleep(max(1.0, min(next_run.values()) - time.monotonic()))
+
+def start_cache_warmer():
+    """Start the background cache warmer once per serving process (see gunicorn.conf.py)"""
+    global _warmer_started
+    if _warmer_started or os.environ.get('CACHE_WARMER', '1') == '0':
+        return
+    _warmer_started = True
+    threading.Thread(target=_warm_caches, name='cache-warmer', daemon=True).start()
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
+    # Development server only; production runs under gunicorn (see Procfile)
+    dev = bool(os.environ.get('FLASK_DEV'))
+    
+    # With the reloader on, only the child process serves requests
+    if not dev or os.environ.get('WERKZEUG_RUN_MAIN'):
+        start_cache_warmer()
+    app.run(debug=dev, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
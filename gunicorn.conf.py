@@ -0,0 +1,6 @@
+# Gunicorn settings for the worker command in the Procfile
+
+def post_worker_init(worker):
+    """Start the cache warmer in each worker once the app has loaded"""
+    from app import start_cache_warmer
+    start_cache_warmer()